@@ -5,45 +5,38 @@ preprocess.py
 Unified script to run all preprocessing steps directly by importing modules,
 including generating the source.txt file from a specified local path or remote URL:
 1. Ingest source via gitingest.ingest (URL or local path)
-2. Generate data/source.txt
-3. Chunk data from data/source.txt into data/data_chunks.json
-4. Generate context and produce data/final_data.json
-5. Initialize the vector database (creates collection/table)
-6. Populate the database with embeddings from final_data.json
+2. Generate data/<collection>/source.txt
+3. Chunk data from source.txt into data/<collection>/data_chunks.json
+4. Generate context and produce data/<collection>/final_data.json
+5. Initialize the vector database (creates the table and the collection partition)
+6. Populate the collection with embeddings from final_data.json
 
 Usage:
-  python preprocess.py --source <LOCAL_PATH_OR_URL>
-  python preprocess.py                  # uses existing data/source.txt in ./data
+  python preprocess.py --source <LOCAL_PATH_OR_URL> --collection <NAME>
+  python preprocess.py                  # uses existing source.txt in ./data/pandas_ta
+  python preprocess.py --collection <NAME> --rebuild   # drops the collection before populating
+  python preprocess.py --collection <NAME> --blue-green   # rebuilds in a shadow table, then swaps
+  python preprocess.py --context-mode batch   # re-run to collect results and resume
+  python preprocess.py --only-stage embed   # runs a single stage: source, chunk, context or embed
 """
 
-from dotenv import load_dotenv
-load_dotenv()
-
 import os
 import sys
 import json
 import asyncio
 import argparse
-import tempfile
-import shutil
-import subprocess
-from gitingest import ingest
 
-# Import preprocessing modules
-from src.preprocessing.chunk_splitter import (
-    split_in_root_folders,
-    aggregate_files_by_token,
-    save_as_json,
-)
-from src.preprocessing.context_generator import generate_context
+# Heavy dependencies (gitingest, tiktoken, openai, pydantic-ai, asyncpg) are
+# imported inside the stage that needs them, so running a single stage only
+# pays for its own imports.
 
-# Import database and embeddings modules
-from src.core.database import build_search_db
-from src.embeddings import populate_db
+STAGES = ['source', 'chunk', 'context', 'embed']
 
 
 def generate_source(source_spec: str, data_dir: str = 'data') -> None:
-    """Generate data/source.txt via gitingest.ingest or fallback to manual directory walk."""
+    """Generate <data_dir>/source.txt via gitingest.ingest or fallback to manual directory walk."""
+    from gitingest import ingest
+
     data_path = data_dir if os.path.isabs(data_dir) else os.path.join(os.getcwd(), data_dir)
     os.makedirs(data_path, exist_ok=True)
     dest = os.path.join(data_path, 'source.txt')
@@ -71,7 +64,11 @@ def generate_source(source_spec: str, data_dir: str = 'data') -> None:
     print(f"Generating source.txt via manual walk from {source_spec}...")
     with open(dest, 'w', encoding='utf-8') as out:
         for root, dirs, files in os.walk(source_spec):
-            dirs[:] = [d for d in dirs if d not in ['.git', os.path.basename(data_path)]]
+            dirs[:] = [
+                d for d in dirs
+                if d != '.git'
+                and not os.path.join(data_path, '').startswith(os.path.join(os.path.abspath(root), d, ''))
+            ]
             for fname in files:
                 path = os.path.join(root, fname)
                 rel = os.path.relpath(path, source_spec)
@@ -87,6 +84,12 @@ def generate_source(source_spec: str, data_dir: str = 'data') -> None:
 
 def chunk_data(data_dir: str):
     """Chunk the source.txt into data_chunks.json."""
+    from src.preprocessing.chunk_splitter import (
+        split_in_root_folders,
+        aggregate_files_by_token,
+        save_as_json,
+    )
+
     src = os.path.join(data_dir, 'source.txt')
     out_file = 'data_chunks.json'
     print(f"Chunking data from {src}...")
@@ -96,62 +99,178 @@ def chunk_data(data_dir: str):
     print(f"Saved chunks to {os.path.join(data_dir, out_file)}")
 
 
-def generate_context_data(data_dir: str):
-    """Enrich chunks with context to produce final_data.json."""
+def generate_context_data(data_dir: str, context_mode: str = 'online') -> bool:
+    """
+    Enrich chunks with context to produce final_data.json.
+
+    In the batch modes the chunks are submitted as batch jobs under
+    data/batches. Returns False while batches are still in progress; the
+    pipeline is then re-run later to collect the results and resume.
+    """
+    from src.preprocessing.chunk_splitter import save_as_json
+
     chunk_file = os.path.join(data_dir, 'data_chunks.json')
     print(f"Loading chunked data from {chunk_file}...")
     with open(chunk_file, 'r', encoding='utf-8') as f:
         data_chunks = json.load(f)
-    print("Generating context for each chunk...")
-    contextual = asyncio.run(generate_context(data_chunks))
+    if context_mode == 'online':
+        from src.preprocessing.context_generator import generate_context
+
+        print("Generating context for each chunk...")
+        contextual = asyncio.run(generate_context(data_chunks))
+    elif context_mode == 'grouped':
+        from src.preprocessing.context_generator import generate_grouped_context
+
+        print("Generating context for sibling chunks with a shared folder prefix...")
+        contextual = asyncio.run(generate_grouped_context(data_chunks))
+    else:
+        from src.preprocessing.batch_context import (
+            LocalBatchRunner,
+            OpenAIBatchRunner,
+            generate_context_in_batches,
+        )
+
+        batch_dir = os.path.join(data_dir, 'batches')
+        runner = LocalBatchRunner() if context_mode == 'local-batch' else OpenAIBatchRunner()
+        print(f"Generating context in batches under {batch_dir}...")
+        contextual = asyncio.run(generate_context_in_batches(data_chunks, batch_dir, runner))
+        if contextual is None:
+            return False
     merged = {key: [f"{ctx}\n{chunk}" for ctx, chunk in zip(contextual[key], data_chunks[key])] for key in data_chunks}
     save_as_json(data=merged, output_dir=data_dir, file_name='final_data.json')
     print(f"Saved final data to {os.path.join(data_dir, 'final_data.json')}")
+    return True
+
 
+def setup_database(collection: str, rebuild: bool = False):
+    """Initialize the vector database (creates table, extension and collection partition if not exists)."""
+    from src.core.database import build_search_db, drop_collection
 
-def setup_database():
-    """Initialize the vector database (creates table and extension if not exists)."""
-    print("Initializing vector database...")
-    asyncio.run(build_search_db())
+    if rebuild:
+        print(f"Dropping collection {collection}...")
+        asyncio.run(drop_collection(collection))
+    print(f"Initializing vector database for collection {collection}...")
+    try:
+        asyncio.run(build_search_db(collection))
+    except RuntimeError as e:
+        sys.exit(f"Error: {e}")
     print("Database initialized.")
 
 
-def generate_embeddings(data_dir: str):
+def generate_embeddings(data_dir: str, collection: str):
     """Populate the database with embeddings from final_data.json."""
+    from src.embeddings import populate_db
+
     final_file = os.path.join(data_dir, 'final_data.json')
     print(f"Loading final data from {final_file}...")
     with open(final_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
     print("Generating and inserting embeddings...")
-    asyncio.run(populate_db(data))
+    asyncio.run(populate_db(data, collection))
+    print("Embeddings populated.")
+
+
+def generate_embeddings_blue_green(data_dir: str, collection: str):
+    """
+    Rebuild a collection without downtime: load final_data.json into a shadow
+    table, build its indexes once after the load, validate it and atomically
+    swap it in place of the live partition.
+    """
+    from src.core.database import create_shadow, index_shadow, swap_shadow, validate_shadow
+    from src.embeddings import populate_db
+
+    final_file = os.path.join(data_dir, 'final_data.json')
+    print(f"Loading final data from {final_file}...")
+    with open(final_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    try:
+        shadow = asyncio.run(create_shadow(collection))
+    except RuntimeError as e:
+        sys.exit(f"Error: {e}")
+    print(f"Generating and inserting embeddings into {shadow}...")
+    asyncio.run(populate_db(data, collection, table=shadow))
+    print(f"Building indexes on {shadow}...")
+    asyncio.run(index_shadow(collection))
+    try:
+        asyncio.run(validate_shadow(collection, sum(len(values) for values in data.values())))
+    except RuntimeError as e:
+        sys.exit(f"Error: validation failed, live collection left untouched: {e}")
+    try:
+        asyncio.run(swap_shadow(collection))
+    except RuntimeError as e:
+        sys.exit(f"Error: {e}")
     print("Embeddings populated.")
 
 
 def main():
+    from dotenv import load_dotenv
+    from src.core.database import partition_name
+    from src.core.settings import settings
+
+    load_dotenv()
+
     parser = argparse.ArgumentParser(description='Preprocess pipeline with source ingestion')
     parser.add_argument('--source', help='Local path or remote URL for ingestion')
     parser.add_argument('--data-dir', default='data', help='Data directory name')
+    parser.add_argument(
+        '--collection',
+        default=settings.DEFAULT_COLLECTION,
+        help='Corpus name; its files are kept under <data-dir>/<collection> and its rows in their own partition',
+    )
+    parser.add_argument('--rebuild', action='store_true', help='Drop the collection before populating it')
+    parser.add_argument(
+        '--blue-green',
+        action='store_true',
+        help='Build the collection in a shadow table and swap it in atomically once validated',
+    )
+    parser.add_argument(
+        '--context-mode',
+        choices=['online', 'grouped', 'batch', 'local-batch'],
+        default='online',
+        help='Generate context per request (online), several sibling chunks per request '
+             'with a shared folder prefix (grouped), through the OpenAI Batch API (batch) '
+             'or with the local batch stand-in (local-batch). Batch modes resume on re-run.',
+    )
+    parser.add_argument('--only-stage', choices=STAGES, help='Run a single stage of the pipeline')
     args = parser.parse_args()
 
+    try:
+        partition_name(args.collection)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
     project_root = os.getcwd()
-    data_dir = "data"
+    data_dir = os.path.join(args.data_dir, args.collection)
 
     # Determine source specification
     source_spec = args.source or project_root
 
+    stages = [args.only_stage] if args.only_stage else STAGES
+
     source_path = os.path.join(data_dir, 'source.txt')
-    if args.source:
-        generate_source(source_spec, data_dir)
-    else:
-        if not os.path.exists(source_path):
-            sys.exit(f"Error: source.txt not found at {source_path}. Please provide --source to generate it.")
-        print(f"Using existing source.txt at {source_path}, skipping generation.")
+    if 'source' in stages:
+        if args.source:
+            generate_source(source_spec, data_dir)
+        elif args.only_stage == 'source':
+            sys.exit("Error: --only-stage source requires --source.")
+        else:
+            if not os.path.exists(source_path):
+                sys.exit(f"Error: source.txt not found at {source_path}. Please provide --source to generate it.")
+            print(f"Using existing source.txt at {source_path}, skipping generation.")
 
     # Run processing steps
-    chunk_data(data_dir)
-    generate_context_data(data_dir)
-    setup_database()
-    generate_embeddings(data_dir)
+    if 'chunk' in stages:
+        chunk_data(data_dir)
+    if 'context' in stages:
+        if not generate_context_data(data_dir, args.context_mode):
+            print("Batches still in progress. Re-run the same command later to resume.")
+            return
+    if 'embed' in stages:
+        if args.blue_green:
+            generate_embeddings_blue_green(data_dir, args.collection)
+        else:
+            setup_database(args.collection, args.rebuild)
+            generate_embeddings(data_dir, args.collection)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,13 @@
-from pydantic_ai import Agent, RunContext
+from dataclasses import dataclass
+from functools import cache
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from src.core.settings import settings
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
 
 system_prompt = """
 Your function is to provide context for the text you will receive, based on the directory structure defined in the `directory_context` function. Each text fragment you receive will be one of the following cases:
@@ -7,16 +16,100 @@ Your function is to provide context for the text you will receive, based on the
 You should return, in under 200 characters, the context in which this document appears, as well as the main topics and technologies it covers. The goal is to clarify which files are included in each fragment, which subdirectories exist, and what is being addressed.
 """
 
+grouped_system_prompt = """
+Your function is to provide context for several text fragments of the same root folder at once. The directory tree and a summary of the root folder are given after these instructions. Each fragment is introduced by a line `### Chunk <index>` and will be one of the following cases:
+- A concatenation of multiple files within the root folder, where transitions between files are marked in the text.
+- A single file that has been split because it is too large. In this case, the beginning of the file will indicate which part it is: Part (m/n), where m ≤ n.
+For every fragment, return its index and, in under 200 characters, the context in which it appears, as well as the main topics and technologies it covers. The goal is to clarify which files are included in each fragment, which subdirectories exist, and what is being addressed.
+"""
+
+folder_summary_prompt = """
+You will receive the directory tree of a root folder of a code repository. Return, in under 400 characters, a summary of what the folder contains and which topics and technologies it addresses.
+"""
+
+
+model_name = 'chatgpt-4o-latest'
+
+
+def root_folder_prompt(folder: str) -> str:
+    return f'O texto pertence a pasta {folder}, situada na raiz'
+
+
+@dataclass
+class FolderPrefix:
+    folder: str
+    tree: str
+    summary: str = ''
+
+    def render(self) -> str:
+        prefix = f'{root_folder_prompt(self.folder)}\n\nDirectory tree:\n{self.tree}'
+        if self.summary:
+            prefix += f'\n\nFolder summary:\n{self.summary}'
+        return prefix
+
+
+class ChunkContext(BaseModel):
+    index: int
+    context: str
+
+
+# The agents are built on first use, so importing this module does not load
+# pydantic-ai.
+@cache
+def get_contextual_agent() -> 'Agent[str, str]':
+    from pydantic_ai import Agent, RunContext
+
+    contextual_agent = Agent(
+        f'openai:{model_name}',
+        system_prompt=system_prompt,
+        result_type=str,
+        deps_type=str,
+        retries=2,
+    )
+
+    @contextual_agent.system_prompt
+    def root_folder(ctx: RunContext[str]) -> str:
+        return root_folder_prompt(ctx.deps)
+
+    return contextual_agent
+
+
+@cache
+def get_grouped_contextual_agent() -> 'Agent[FolderPrefix, list[ChunkContext]]':
+    from pydantic_ai import Agent, RunContext
+
+    # The static instructions and the folder prefix come first and are
+    # identical for every request of the same folder, so the provider can
+    # cache them.
+    grouped_contextual_agent = Agent(
+        f'openai:{settings.GROUPED_CONTEXT_MODEL}',
+        system_prompt=grouped_system_prompt,
+        result_type=list[ChunkContext],
+        deps_type=FolderPrefix,
+        retries=2,
+    )
+
+    @grouped_contextual_agent.system_prompt
+    def folder_prefix(ctx: RunContext[FolderPrefix]) -> str:
+        return ctx.deps.render()
+
+    return grouped_contextual_agent
+
+
+@cache
+def get_folder_summary_agent() -> 'Agent[str, str]':
+    from pydantic_ai import Agent, RunContext
 
-contextual_agent = Agent(
-    'openai:chatgpt-4o-latest',
-    system_prompt=system_prompt,
-    result_type=str,
-    deps_type=str,
-    retries=2,
-)
+    folder_summary_agent = Agent(
+        f'openai:{settings.GROUPED_CONTEXT_MODEL}',
+        system_prompt=folder_summary_prompt,
+        result_type=str,
+        deps_type=str,
+        retries=2,
+    )
 
+    @folder_summary_agent.system_prompt
+    def root_folder(ctx: RunContext[str]) -> str:
+        return root_folder_prompt(ctx.deps)
 
-@contextual_agent.system_prompt
-def root_folder(ctx: RunContext[str]) -> str:
-    return f'O texto pertence a pasta {ctx.deps}, situada na raiz'
+    return folder_summary_agent
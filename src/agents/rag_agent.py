@@ -2,28 +2,28 @@
 RAG example from LangChain using pgvector as database
 """
 
-from dotenv import load_dotenv
-load_dotenv()
-
 import os
 import asyncio
 import sys
 from collections.abc import AsyncGenerator
 from dataclasses import dataclass
-
-import asyncpg
-import pydantic_core
-from openai import AsyncOpenAI
-from pydantic_ai import RunContext
-from pydantic_ai.agent import Agent
+from functools import cache
+from typing import TYPE_CHECKING
 
 from src.core.database import database_connect
+from src.core.settings import settings
+
+if TYPE_CHECKING:
+    import asyncpg
+    from openai import AsyncOpenAI
+    from pydantic_ai.agent import Agent
 
 
 @dataclass
 class Deps:
-    openai: AsyncOpenAI
-    pool: asyncpg.Pool
+    openai: 'AsyncOpenAI'
+    pool: 'asyncpg.Pool'
+    collection: str
 
 
 system_prompt = """
@@ -35,62 +35,88 @@ Use the `retrieve` function to get results related to the user's question.
 """
 
 
-agent = Agent(
-    'openai:gpt-3.5-turbo',
-    system_prompt=system_prompt,
-    deps_type=Deps,
-    result_type=str,
-)
+@cache
+def get_agent() -> 'Agent[Deps, str]':
+    """
+    Build the RAG agent on first use, so importing this module (e.g. from the
+    CLI or the Streamlit app) does not load pydantic-ai, openai or dotenv.
+    """
+    import pydantic_core
+    from dotenv import load_dotenv
+    from pydantic_ai import RunContext
+    from pydantic_ai.agent import Agent
+
+    load_dotenv()
+
+    agent = Agent(
+        'openai:gpt-3.5-turbo',
+        system_prompt=system_prompt,
+        deps_type=Deps,
+        result_type=str,
+    )
 
+    @agent.tool
+    async def retrieve(context: RunContext[Deps], search_query: str) -> str:
+        """Retrieve documentation sections based on a search query.
 
-@agent.tool
-async def retrieve(context: RunContext[Deps], search_query: str) -> str:
-    """Retrieve documentation sections based on a search query.
+        Args:
+            context: The call context.
+            search_query: The search query.
+        """
 
-    Args:
-        context: The call context.
-        search_query: The search query.
-    """
+        response = await context.deps.openai.embeddings.create(
+            input=search_query,
+            model='text-embedding-3-small',
+        )
 
-    response = await context.deps.openai.embeddings.create(
-        input=search_query,
-        model='text-embedding-3-small',
-    )
+        embedding = response.data[0].embedding
+        embedding_json = pydantic_core.to_json(embedding).decode()
+        rows = await context.deps.pool.fetch(
+            """
+            SELECT folder, content FROM repo
+            WHERE collection = $2
+            ORDER BY embedding <=> $1 LIMIT 1
+            """,
+            embedding_json,
+            context.deps.collection,
+        )
 
-    embedding = response.data[0].embedding
-    embedding_json = pydantic_core.to_json(embedding).decode()
-    rows = await context.deps.pool.fetch(
-        """
-        SELECT folder, content FROM repo
-        ORDER BY embedding <=> $1 LIMIT 1
-        """,
-        embedding_json,
-    )
+        return '\n\n'.join(f'Conteudo:\n{row["content"]}\n' for row in rows)
 
-    return '\n\n'.join(f'Conteudo:\n{row["content"]}\n' for row in rows)
+    return agent
 
 
-async def stream_messages(question: str) -> AsyncGenerator[str, None]:
+async def stream_messages(
+    question: str, collection: str = settings.DEFAULT_COLLECTION
+) -> AsyncGenerator[str, None]:
     """
     Stream messages for Streamlit interface.
     """
+    from openai import AsyncOpenAI
+
+    agent = get_agent()
     openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
     async with database_connect() as pool:
-        deps = Deps(openai=openai, pool=pool)
+        deps = Deps(openai=openai, pool=pool, collection=collection)
         async with agent.run_stream(question, deps=deps) as result:
             async for message in result.stream_text(delta=True):
                 yield message
 
 
-async def run_agent(question: str) -> None:
+async def run_agent(
+    question: str, collection: str = settings.DEFAULT_COLLECTION
+) -> None:
     """
     Entry point to run the agent and perform RAG based question answering.
     """
+    from openai import AsyncOpenAI
+
+    agent = get_agent()
     openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
     async with database_connect() as pool:
-        deps = Deps(openai=openai, pool=pool)
+        deps = Deps(openai=openai, pool=pool, collection=collection)
         answer = await agent.run(question, deps=deps)
 
     print(answer.data)
@@ -100,10 +126,14 @@ if __name__ == '__main__':
     action = sys.argv[1] if len(sys.argv) > 1 else None
 
     if action == 'search':
-        if len(sys.argv) == 3:
+        if len(sys.argv) >= 3:
             q = sys.argv[2]
         else:
             q = ''
-        asyncio.run(run_agent(q))
+        if len(sys.argv) == 4:
+            collection = sys.argv[3]
+        else:
+            collection = settings.DEFAULT_COLLECTION
+        asyncio.run(run_agent(q, collection))
     else:
         print('Exiting')
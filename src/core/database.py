@@ -1,14 +1,22 @@
 import asyncio
+import re
+import sys
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
-
-import asyncpg
+from typing import TYPE_CHECKING
 
 from src.core.settings import settings
 
+if TYPE_CHECKING:
+    import asyncpg
+
 
 @asynccontextmanager
-async def database_connect() -> AsyncGenerator[asyncpg.Pool, None]:
+async def database_connect() -> AsyncGenerator['asyncpg.Pool', None]:
+    # Imported here so that CLI stages that never touch the database do not
+    # pay for the driver import.
+    import asyncpg
+
     pool = None
     try:
         pool = await asyncpg.create_pool(settings.DATABASE_URL)
@@ -18,30 +26,258 @@ async def database_connect() -> AsyncGenerator[asyncpg.Pool, None]:
             await pool.close()
 
 
+# Each collection (corpus) lives in its own partition of `repo`, so every
+# corpus has its own HNSW index and can be rebuilt or dropped independently.
 DB_SCHEMA = """
 CREATE EXTENSION IF NOT EXISTS vector;
 
 CREATE TABLE IF NOT EXISTS repo (
-    id serial PRIMARY KEY,
+    id serial,
+    collection text NOT NULL,
     folder text NOT NULL,
     content text NOT NULL,
     -- text-embedding-3-small returns a vector of 1536 floats
-    embedding vector(1536) NOT NULL
-);
+    embedding vector(1536) NOT NULL,
+    PRIMARY KEY (collection, id)
+) PARTITION BY LIST (collection);
 
+-- Retrieval orders by cosine distance (<=>), the operator class must match
+-- for the index to be used.
 CREATE INDEX
 IF NOT EXISTS idx_repo_embedding
 ON repo
-USING hnsw (embedding vector_l2_ops);
+USING hnsw (embedding vector_cosine_ops);
 """
 
+COLLECTION_PATTERN = re.compile(r'[a-z][a-z0-9_]{0,47}')
+
+# Blue/green rebuilds keep the shadow and previous generations of a
+# collection next to its partition under these suffixes. Collections may not
+# end with them, or a rebuild could drop another collection's partition.
+SHADOW_SUFFIX = '_next'
+OLD_SUFFIX = '_old'
+
+
+def partition_name(collection: str) -> str:
+    """
+    Returns the name of the partition holding a collection.
+
+    Collection names are used as SQL identifiers, so only lowercase letters,
+    digits and underscores are accepted, and the suffixes reserved for
+    blue/green generations are rejected.
+    """
+    if not COLLECTION_PATTERN.fullmatch(collection):
+        raise ValueError(
+            f'Invalid collection name {collection!r}: use lowercase letters, '
+            'digits and underscores, starting with a letter.'
+        )
+    if collection.endswith((SHADOW_SUFFIX, OLD_SUFFIX)):
+        raise ValueError(
+            f'Invalid collection name {collection!r}: the suffixes '
+            f'{SHADOW_SUFFIX!r} and {OLD_SUFFIX!r} are reserved for rebuilds.'
+        )
+    return f'repo_{collection}'
+
+
+async def check_partitioned(conn: 'asyncpg.Connection') -> None:
+    """
+    Fails clearly when `repo` predates collections: CREATE TABLE IF NOT
+    EXISTS leaves such a table untouched and partitions cannot be attached
+    to it.
+
+    :raises RuntimeError: If `repo` is not a partitioned table.
+    """
+    partitioned = await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = to_regclass('repo')
+        )
+        """
+    )
+    if not partitioned:
+        raise RuntimeError(
+            'The repo table was created before collections were introduced '
+            'and is not partitioned by collection. Drop it (DROP TABLE repo) '
+            'or migrate its rows into the partitioned layout, then rebuild '
+            'the collections.'
+        )
+
 
-async def build_search_db() -> None:
+async def build_search_db(collection: str = settings.DEFAULT_COLLECTION) -> None:
+    partition = partition_name(collection)
     async with database_connect() as pool:
         async with pool.acquire() as conn:
             async with conn.transaction():
                 await conn.execute(DB_SCHEMA)
+                await check_partitioned(conn)
+                await conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {partition}
+                    PARTITION OF repo FOR VALUES IN ('{collection}')
+                    """
+                )
+
+
+async def drop_collection(collection: str) -> None:
+    async with database_connect() as pool:
+        await pool.execute(
+            f'DROP TABLE IF EXISTS {partition_name(collection)}'
+        )
+
+
+def shadow_name(collection: str) -> str:
+    return f'{partition_name(collection)}{SHADOW_SUFFIX}'
+
+
+async def create_shadow(collection: str) -> str:
+    """
+    Creates an empty shadow table for a new generation of a collection.
+
+    The table has the layout of `repo` and no indexes, so the bulk load does
+    not update the HNSW graph row by row. The CHECK constraint lets the
+    table be attached as a partition without a validation scan.
+    """
+    partition = partition_name(collection)
+    shadow = shadow_name(collection)
+    async with database_connect() as pool:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(DB_SCHEMA)
+                await check_partitioned(conn)
+                await conn.execute(f'DROP TABLE IF EXISTS {shadow}')
+                await conn.execute(
+                    f"""
+                    CREATE TABLE {shadow} (
+                        LIKE repo INCLUDING DEFAULTS,
+                        CHECK (collection = '{collection}')
+                    )
+                    """
+                )
+    print(f'Created shadow table {shadow} for {partition}')
+    return shadow
+
+
+async def index_shadow(collection: str) -> None:
+    """Builds the shadow table indexes once, after the bulk load."""
+    shadow = shadow_name(collection)
+    async with database_connect() as pool:
+        await pool.execute(f'ALTER TABLE {shadow} ADD PRIMARY KEY (collection, id)')
+        await pool.execute(
+            f'CREATE INDEX ON {shadow} USING hnsw (embedding vector_cosine_ops)'
+        )
+
+
+async def validate_shadow(
+    collection: str, expected_rows: int, sample_size: int = 5
+) -> None:
+    """
+    Checks the shadow table before it goes live.
+
+    The row count must match the number of loaded records, and sampled rows
+    must be returned as their own nearest neighbour through the index.
+
+    :raises RuntimeError: If any check fails.
+    """
+    shadow = shadow_name(collection)
+    async with database_connect() as pool:
+        rows = await pool.fetchval(f'SELECT count(*) FROM {shadow}')
+        if rows != expected_rows:
+            raise RuntimeError(
+                f'{shadow} has {rows} rows, expected {expected_rows}'
+            )
+
+        samples = await pool.fetch(
+            f'SELECT id, embedding::text AS embedding FROM {shadow} '
+            'ORDER BY random() LIMIT $1',
+            sample_size,
+        )
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # On a small table the planner would rather scan it, which
+                # would leave the new HNSW index unchecked.
+                await conn.execute('SET LOCAL enable_seqscan = off')
+                for sample in samples:
+                    # Duplicated chunks may share an embedding, so the
+                    # nearest distance is checked rather than the returned id.
+                    distance = await conn.fetchval(
+                        f"""
+                        SELECT embedding <=> $1::vector FROM {shadow}
+                        ORDER BY embedding <=> $1::vector LIMIT 1
+                        """,
+                        sample['embedding'],
+                    )
+                    if distance is None or distance > 1e-6:
+                        raise RuntimeError(
+                            f'Sample query for row {sample["id"]} of {shadow} '
+                            'did not return the row itself'
+                        )
+
+
+async def swap_shadow(collection: str) -> None:
+    """
+    Atomically replaces the live partition of a collection with its shadow
+    table and drops the previous generation.
+
+    Detaching takes an ACCESS EXCLUSIVE lock on `repo`, so queries on every
+    collection wait for the swap. The swap gives up on the lock after
+    SWAP_LOCK_TIMEOUT instead of queueing behind a long-running query, and
+    is retried SWAP_MAX_ATTEMPTS times.
+
+    :raises RuntimeError: If the lock could not be acquired.
+    """
+    import asyncpg
+
+    partition = partition_name(collection)
+    shadow = shadow_name(collection)
+    old = f'{partition}{OLD_SUFFIX}'
+    async with database_connect() as pool:
+        for attempt in range(1, settings.SWAP_MAX_ATTEMPTS + 1):
+            try:
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.execute(
+                            f"SET LOCAL lock_timeout = '{settings.SWAP_LOCK_TIMEOUT}'"
+                        )
+                        await conn.execute(f'DROP TABLE IF EXISTS {old}')
+                        live = await conn.fetchval(
+                            'SELECT to_regclass($1)', partition
+                        )
+                        if live is not None:
+                            await conn.execute(
+                                f'ALTER TABLE repo DETACH PARTITION {partition}'
+                            )
+                            await conn.execute(
+                                f'ALTER TABLE {partition} RENAME TO {old}'
+                            )
+                        await conn.execute(
+                            f'ALTER TABLE {shadow} RENAME TO {partition}'
+                        )
+                        await conn.execute(
+                            f"ALTER TABLE repo ATTACH PARTITION {partition} "
+                            f"FOR VALUES IN ('{collection}')"
+                        )
+                break
+            except asyncpg.exceptions.LockNotAvailableError:
+                print(
+                    f'Swap of {partition} timed out waiting for the lock '
+                    f'(attempt {attempt}/{settings.SWAP_MAX_ATTEMPTS})'
+                )
+                await asyncio.sleep(attempt)
+        else:
+            raise RuntimeError(
+                f'Could not acquire the lock to swap {shadow} into '
+                f'{partition}; the live collection is untouched.'
+            )
+        await pool.execute(f'DROP TABLE IF EXISTS {old}')
+    print(f'Swapped {shadow} into {partition}')
 
 
 if __name__ == '__main__':
-    asyncio.run(build_search_db())
+    action = sys.argv[1] if len(sys.argv) > 1 else 'create'
+    collection = sys.argv[2] if len(sys.argv) > 2 else settings.DEFAULT_COLLECTION
+
+    if action == 'drop':
+        asyncio.run(drop_collection(collection))
+    else:
+        asyncio.run(build_search_db(collection))
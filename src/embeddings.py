@@ -16,11 +16,14 @@ from src.core.database import database_connect
 
 @dataclass
 class Record:
+    collection: str
     folder: str
     content: str
 
 
-async def populate_db(data: dict[str, list[str]]) -> None:
+async def populate_db(
+    data: dict[str, list[str]], collection: str, table: str = 'repo'
+) -> None:
     openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
     async with database_connect() as pool:
@@ -28,8 +31,10 @@ async def populate_db(data: dict[str, list[str]]) -> None:
         async with asyncio.TaskGroup() as tg:
             for key, values in data.items():
                 for value in values:
-                    record = Record(folder=key, content=value)
-                    tg.create_task(insert_record(sem, openai, pool, record))
+                    record = Record(collection=collection, folder=key, content=value)
+                    tg.create_task(
+                        insert_record(sem, openai, pool, record, table)
+                    )
 
 
 async def insert_record(
@@ -37,9 +42,10 @@ async def insert_record(
     openai: AsyncOpenAI,
     pool: asyncpg.Pool,
     record: Record,
+    table: str = 'repo',
 ) -> None:
     async with sem:
-        print(f'Populating {record.folder}')
+        print(f'Populating {record.collection}/{record.folder}')
         response = await openai.embeddings.create(
             input=record.content,
             model='text-embedding-3-small',
@@ -48,10 +54,11 @@ async def insert_record(
         embedding = response.data[0].embedding
         embedding_json = pydantic_core.to_json(embedding).decode()
         await pool.execute(
-            """
-            INSERT INTO repo (folder, content, embedding)
-            VALUES ($1, $2, $3)
+            f"""
+            INSERT INTO {table} (collection, folder, content, embedding)
+            VALUES ($1, $2, $3, $4)
             """,
+            record.collection,
             record.folder,
             record.content,
             embedding_json,
@@ -0,0 +1,425 @@
+"""
+Offline context generation through Batch-API-style JSONL files.
+
+Chunks are written as request files, submitted as batch jobs and the result
+files are collected on later runs. Progress is kept in a state file inside
+the batch directory, so the pipeline can be re-run to resume without holding
+a process open while the jobs are processed.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Protocol
+
+from src.agents.contextual_agent import (
+    get_contextual_agent,
+    root_folder_prompt,
+    system_prompt,
+)
+from src.core.settings import settings
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+STATE_FILE = 'state.json'
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+# Per-request HTTP statuses worth retrying in a later batch; any other 4xx
+# (invalid request, unknown model, ...) fails the same way every time.
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class BatchRunner(Protocol):
+    async def submit(self, requests_path: Path, results_path: Path) -> str:
+        """Submit a request file and return the batch id."""
+        ...
+
+    async def poll(self, batch_id: str, results_path: Path) -> str:
+        """
+        Return the batch status, writing the results file, and the errors
+        file next to it when requests failed, once the batch reaches a
+        terminal status.
+        """
+        ...
+
+
+class OpenAIBatchRunner:
+    """Runs request files through the OpenAI Batch API."""
+
+    def __init__(self) -> None:
+        from openai import AsyncOpenAI
+
+        self.client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+    async def submit(self, requests_path: Path, results_path: Path) -> str:
+        with open(requests_path, 'rb') as file:
+            uploaded = await self.client.files.create(
+                file=file, purpose='batch'
+            )
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=settings.BATCH_COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str, results_path: Path) -> str:
+        batch = await self.client.batches.retrieve(batch_id)
+
+        if batch.status not in TERMINAL_STATUSES:
+            return batch.status
+
+        if batch.output_file_id:
+            content = await self.client.files.content(batch.output_file_id)
+            with open(results_path, 'wb') as file:
+                file.write(content.read())
+
+        if batch.errors and batch.errors.data:
+            # Batch-level errors, e.g. the request file failed validation.
+            for error in batch.errors.data:
+                print(
+                    f'Batch {batch_id} error {error.code} '
+                    f'(line {error.line}): {error.message}'
+                )
+
+        if batch.error_file_id:
+            content = await self.client.files.content(batch.error_file_id)
+            errors_path = errors_file(results_path)
+            with open(errors_path, 'wb') as file:
+                file.write(content.read())
+            print(f'Batch {batch_id}: failed requests saved to {errors_path}')
+
+        return batch.status
+
+
+class LocalBatchRunner:
+    """
+    Local stand-in for the Batch API.
+
+    Requests are answered one by one with the given agent, the contextual
+    agent by default, and each result line is appended as soon as it is
+    available, so an interrupted run leaves a partially completed results
+    file behind. Passing an agent backed by a pydantic-ai ``TestModel`` or
+    ``FunctionModel`` runs the whole flow offline.
+    """
+
+    def __init__(self, agent: 'Agent[str, str] | None' = None) -> None:
+        self.agent = agent
+
+    async def submit(self, requests_path: Path, results_path: Path) -> str:
+        agent = self.agent or get_contextual_agent()
+        batch_id = f'local-{requests_path.stem}'
+
+        with open(requests_path, 'r', encoding='utf-8') as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+
+        with open(results_path, 'a', encoding='utf-8') as out:
+            for request in requests:
+                key, _, _ = parse_custom_id(request['custom_id'])
+                chunk = request['body']['messages'][-1]['content']
+                response = await agent.run(chunk, deps=key)
+                out.write(json.dumps(result_line(request, response.data)))
+                out.write('\n')
+                out.flush()
+
+        return batch_id
+
+    async def poll(self, batch_id: str, results_path: Path) -> str:
+        return 'completed'
+
+
+def make_custom_id(key: str, index: int, chunk: str) -> str:
+    """
+    Identify a chunk by folder, position and a hash of its content, so
+    results from a previous chunking of a different source are not matched
+    to the chunk now at the same position.
+    """
+    digest = hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]
+    return f'{key}::{index}::{digest}'
+
+
+def parse_custom_id(custom_id: str) -> tuple[str, int, str]:
+    key, index, digest = custom_id.rsplit('::', 2)
+    return key, int(index), digest
+
+
+def build_request(key: str, index: int, chunk: str) -> dict:
+    """Build a single Batch API request line for a chunk."""
+    return {
+        'custom_id': make_custom_id(key, index, chunk),
+        'method': 'POST',
+        'url': BATCH_ENDPOINT,
+        'body': {
+            'model': settings.BATCH_MODEL,
+            'messages': [
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'system', 'content': root_folder_prompt(key)},
+                {'role': 'user', 'content': chunk},
+            ],
+        },
+    }
+
+
+def result_line(request: dict, content: str) -> dict:
+    """Build a Batch API result line for a request answered locally."""
+    return {
+        'id': f'local-{request["custom_id"]}',
+        'custom_id': request['custom_id'],
+        'response': {
+            'status_code': 200,
+            'body': {
+                'choices': [
+                    {'message': {'role': 'assistant', 'content': content}}
+                ]
+            },
+        },
+        'error': None,
+    }
+
+
+def read_results(batch_dir: str | Path) -> dict[str, str]:
+    """
+    Read every results file in the batch directory.
+
+    Lines that failed, carry an error or were cut off by an interrupted run
+    are ignored, so the corresponding chunks are requested again.
+
+    :param batch_dir: Directory holding the ``results_*.jsonl`` files.
+    :return: A dictionary mapping custom ids to the generated context.
+    """
+    results: dict[str, str] = {}
+
+    for path in sorted(Path(batch_dir).glob('results_*.jsonl')):
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    response = record['response']
+                    if record.get('error') or response['status_code'] != 200:
+                        continue
+                    choice = response['body']['choices'][0]
+                    results[record['custom_id']] = choice['message']['content']
+                except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                    continue
+
+    return results
+
+
+def errors_file(results_path: Path) -> Path:
+    return results_path.with_name(
+        results_path.name.replace('results_', 'errors_')
+    )
+
+
+def read_errors(batch_dir: str | Path) -> dict[str, tuple[int | None, str]]:
+    """
+    Read every errors file in the batch directory.
+
+    :param batch_dir: Directory holding the ``errors_*.jsonl`` files.
+    :return: A dictionary mapping custom ids to the HTTP status code of the
+             failed request, if any, and the error message.
+    """
+    errors: dict[str, tuple[int | None, str]] = {}
+
+    for path in sorted(Path(batch_dir).glob('errors_*.jsonl')):
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    response = record.get('response') or {}
+                    error = record.get('error') or (
+                        (response.get('body') or {}).get('error') or {}
+                    )
+                    errors[record['custom_id']] = (
+                        response.get('status_code'),
+                        error.get('message', ''),
+                    )
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    continue
+
+    return errors
+
+
+def is_retryable(status_code: int | None) -> bool:
+    return (
+        status_code is None
+        or status_code >= 500
+        or status_code in RETRYABLE_STATUS_CODES
+    )
+
+
+def write_request_files(
+    requests: list[dict],
+    batch_dir: str | Path,
+    max_requests: int,
+    start: int = 0,
+) -> list[Path]:
+    """
+    Write requests into JSONL files of at most ``max_requests`` lines.
+
+    :param requests: Batch API request lines.
+    :param batch_dir: Directory where the files will be written.
+    :param max_requests: Maximum number of requests per file.
+    :param start: Number used for the first file name.
+    :return: The paths of the written files.
+    """
+    paths: list[Path] = []
+
+    for n, i in enumerate(range(0, len(requests), max_requests), start=start):
+        path = Path(batch_dir) / f'requests_{n:04d}.jsonl'
+        with open(path, 'w', encoding='utf-8') as file:
+            for request in requests[i : i + max_requests]:
+                file.write(json.dumps(request, ensure_ascii=False))
+                file.write('\n')
+        paths.append(path)
+
+    return paths
+
+
+def load_state(batch_dir: str | Path) -> dict:
+    path = Path(batch_dir) / STATE_FILE
+    if not path.exists():
+        return {'batches': []}
+
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_state(state: dict, batch_dir: str | Path) -> None:
+    with open(Path(batch_dir) / STATE_FILE, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=4)
+
+
+async def generate_context_in_batches(
+    data: dict[str, list[str]],
+    batch_dir: str | Path,
+    runner: BatchRunner,
+) -> dict[str, list[str]] | None:
+    """
+    Advance the batch context generation by one step.
+
+    Batches submitted on previous runs are polled and their results
+    collected. Chunks without a result and not covered by a batch still in
+    progress are written to new request files and submitted. Chunks whose
+    request failed with a non-retryable error, or that were already
+    submitted ``BATCH_MAX_ATTEMPTS`` times, are not submitted again; they
+    are reported so the cause can be fixed.
+
+    :param data: The chunked data, keyed by root folder.
+    :param batch_dir: Directory holding request, result and state files.
+    :param runner: The runner used to submit and poll batches.
+    :return: The contexts keyed by root folder, in the same order as the
+             chunks, or None while batches are still in progress.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    state = load_state(batch_dir)
+    attempts: dict[str, int] = state.setdefault('attempts', {})
+    in_flight: set[str] = set()
+
+    for batch in state['batches']:
+        if batch['status'] in TERMINAL_STATUSES:
+            continue
+
+        if batch['id'] is None:
+            # The submission was interrupted, whatever reached the results
+            # file is kept and the remaining chunks are requested again.
+            batch['status'] = 'failed'
+            continue
+
+        batch['status'] = await runner.poll(
+            batch['id'], Path(batch['results_file'])
+        )
+        print(f'Batch {batch["id"]}: {batch["status"]}')
+
+        if batch['status'] not in TERMINAL_STATUSES:
+            with open(batch['requests_file'], 'r', encoding='utf-8') as file:
+                in_flight.update(
+                    json.loads(line)['custom_id'] for line in file if line.strip()
+                )
+
+    save_state(state, batch_dir)
+
+    custom_ids = {
+        key: [make_custom_id(key, n, chunk) for n, chunk in enumerate(chunks)]
+        for key, chunks in data.items()
+    }
+    expected = {custom_id for ids in custom_ids.values() for custom_id in ids}
+
+    results = read_results(batch_dir)
+    stale = len(results.keys() - expected)
+    if stale:
+        print(f'Discarding {stale} results that no longer match any chunk.')
+
+    errors = read_errors(batch_dir)
+    given_up = {
+        custom_id: (
+            errors[custom_id][1]
+            if custom_id in errors and not is_retryable(errors[custom_id][0])
+            else f'no result after {attempts[custom_id]} attempts'
+        )
+        for custom_id in expected - results.keys()
+        if (custom_id in errors and not is_retryable(errors[custom_id][0]))
+        or attempts.get(custom_id, 0) >= settings.BATCH_MAX_ATTEMPTS
+    }
+
+    pending = [
+        build_request(key, n, chunk)
+        for key, chunks in data.items()
+        for n, chunk in enumerate(chunks)
+        if custom_ids[key][n] not in results
+        and custom_ids[key][n] not in in_flight
+        and custom_ids[key][n] not in given_up
+    ]
+
+    if pending:
+        paths = write_request_files(
+            pending,
+            batch_dir,
+            settings.BATCH_MAX_REQUESTS_PER_FILE,
+            start=len(state['batches']),
+        )
+
+        for path in paths:
+            results_path = path.with_name(
+                path.name.replace('requests_', 'results_')
+            )
+            batch = {
+                'id': None,
+                'requests_file': str(path),
+                'results_file': str(results_path),
+                'status': 'submitting',
+            }
+            state['batches'].append(batch)
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    custom_id = json.loads(line)['custom_id']
+                    attempts[custom_id] = attempts.get(custom_id, 0) + 1
+            save_state(state, batch_dir)
+
+            batch['id'] = await runner.submit(path, results_path)
+            batch['status'] = await runner.poll(batch['id'], results_path)
+            save_state(state, batch_dir)
+            print(f'Submitted {path.name} as {batch["id"]}: {batch["status"]}')
+
+        results = read_results(batch_dir)
+
+    missing = expected - results.keys()
+
+    if missing:
+        print(f'{len(missing)} chunks still waiting for context.')
+        if given_up:
+            print(
+                f'{len(given_up)} of them will not be submitted again. Fix '
+                f'the cause and delete {Path(batch_dir) / STATE_FILE} and '
+                'the errors_*.jsonl files to retry them:'
+            )
+            for custom_id, reason in sorted(given_up.items())[:10]:
+                print(f'  {custom_id}: {reason}')
+        return None
+
+    return {
+        key: [results[custom_id] for custom_id in ids]
+        for key, ids in custom_ids.items()
+    }
@@ -3,9 +3,12 @@ import math
 import os
 import re
 from collections import defaultdict
+from functools import cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import tiktoken
+if TYPE_CHECKING:
+    import tiktoken
 
 
 def split_in_root_folders(input_path: str | Path) -> dict[str, list[str]]:
@@ -170,7 +173,20 @@ def num_tokens_from_string(
     :param encoding_name: The name of the encoding to use for tokenization.
                           Defaults to 'cl100k_base'.
     """
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = get_encoding(encoding_name)
     num_tokens = len(encoding.encode(string))
 
-    return num_tokens
\ No newline at end of file
+    return num_tokens
+
+
+@cache
+def get_encoding(encoding_name: str = 'cl100k_base') -> 'tiktoken.Encoding':
+    """
+    Returns the tokenizer for an encoding, loading tiktoken and building the
+    encoder only on first use.
+
+    :param encoding_name: The name of the encoding. Defaults to 'cl100k_base'.
+    """
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
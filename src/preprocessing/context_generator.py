@@ -1,24 +1,33 @@
 import asyncio
 import json
 import os
+import re
 import time
 from collections import defaultdict
+from typing import TYPE_CHECKING
 
-from pydantic_ai import Agent
-
-from src.agents.contextual_agent import contextual_agent
+from src.agents.contextual_agent import (
+    FolderPrefix,
+    grouped_system_prompt,
+    get_contextual_agent,
+    get_folder_summary_agent,
+    get_grouped_contextual_agent,
+)
 from src.core.settings import settings
 from src.preprocessing.chunk_splitter import (
     num_tokens_from_string,
     save_as_json,
 )
 
-async def fetch(agent: Agent[str], chunk: str, key: str) -> str:
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+
+async def fetch(agent: 'Agent[str]', chunk: str, key: str) -> str:
     response = await agent.run(chunk, deps=key)
     return response
 
 async def async_fetch(values: list[str], key: str) -> list[str]:
-    tasks = [fetch(contextual_agent, value, key) for value in values]
+    tasks = [fetch(get_contextual_agent(), value, key) for value in values]
     responses = await asyncio.gather(*tasks)
     return responses
 
@@ -67,7 +76,7 @@ async def generate_context(data: dict[str, list[str]]) -> dict[str, list[str]]:
                 print('Waiting 60 seconds due to TPM limit...')
                 time.sleep(60)
 
-            response = await contextual_agent.run(value, deps=key)
+            response = await get_contextual_agent().run(value, deps=key)
 
             aggregated_contexts.append(response)
 
@@ -76,3 +85,183 @@ async def generate_context(data: dict[str, list[str]]) -> dict[str, list[str]]:
         json_to_save[key] = aggregated_contexts
 
     return json_to_save
+
+
+def directory_tree(key: str, values: list[str]) -> str:
+    """
+    Builds the directory tree of a root folder from the file names that
+    open each file inside its chunks.
+
+    :param key: The root folder.
+    :param values: The chunks of the root folder.
+    :return: The indented tree, one file or subdirectory per line.
+    """
+    pattern = re.compile(
+        r'^(' + re.escape(key) + r'(?:/\S+)?)(?: - Parte \(\d+/\d+\))?$',
+        re.MULTILINE,
+    )
+    paths = sorted({path for value in values for path in pattern.findall(value)})
+
+    lines: list[str] = [key]
+    seen: set[str] = {key}
+    for path in paths:
+        parts = path.split('/')
+        for depth in range(1, len(parts)):
+            node = '/'.join(parts[: depth + 1])
+            if node not in seen:
+                seen.add(node)
+                lines.append('  ' * depth + parts[depth])
+
+    return '\n'.join(lines)
+
+
+def group_chunks(
+    values: list[str], chunks_per_request: int
+) -> list[list[tuple[int, str]]]:
+    """Groups consecutive chunks, keeping the index of each one."""
+    indexed = list(enumerate(values))
+    return [
+        indexed[i : i + chunks_per_request]
+        for i in range(0, len(indexed), chunks_per_request)
+    ]
+
+
+# Upper bound of the folder summary: the agent is asked for under 400
+# characters.
+SUMMARY_TOKENS = 100
+
+
+async def build_folder_prefix(
+    key: str, values: list[str]
+) -> tuple[FolderPrefix, int]:
+    """
+    Builds the shared prefix of a root folder.
+
+    The folder summary only pays off when it lets the prefix reach the size
+    the provider caches, so it is requested only then; otherwise the prefix
+    holds the directory tree alone.
+
+    :return: The prefix and the tokens billed to build it.
+    """
+    prefix = FolderPrefix(folder=key, tree=directory_tree(key, values))
+    static_tokens = num_tokens_from_string(grouped_system_prompt)
+    prefix_tokens = static_tokens + num_tokens_from_string(prefix.render())
+
+    if prefix_tokens + SUMMARY_TOKENS < settings.PROMPT_CACHE_MIN_TOKENS:
+        print(
+            f'Prefix for {key} has {prefix_tokens} tokens, below the '
+            f'{settings.PROMPT_CACHE_MIN_TOKENS} cached by the provider; '
+            'skipping the folder summary.'
+        )
+        return prefix, 0
+
+    response = await get_folder_summary_agent().run(prefix.tree, deps=key)
+    prefix.summary = response.data
+    tokens = num_tokens_from_string(prefix.tree) + num_tokens_from_string(
+        prefix.summary
+    )
+    return prefix, tokens
+
+
+async def fetch_group(
+    prefix: FolderPrefix, group: list[tuple[int, str]]
+) -> list[str]:
+    """
+    Requests the context of several sibling chunks at once and parses the
+    structured result back into one context per chunk. Chunks missing from
+    the result are requested alone.
+    """
+    prompt = '\n\n'.join(f'### Chunk {index}\n{value}' for index, value in group)
+    response = await get_grouped_contextual_agent().run(prompt, deps=prefix)
+    usage = response.usage()
+    cached = (usage.details or {}).get('cached_tokens', 0)
+    print(
+        f'{prefix.folder}: {usage.request_tokens} prompt tokens, '
+        f'{cached} cached'
+    )
+    contexts = {item.index: item.context for item in response.data}
+
+    for index, value in group:
+        if index not in contexts:
+            single = await get_contextual_agent().run(value, deps=prefix.folder)
+            contexts[index] = single.data
+
+    return [contexts[index] for index, _ in group]
+
+
+async def generate_grouped_context(
+    data: dict[str, list[str]],
+) -> dict[str, list[str]]:
+    """
+    Generates the context of the chunks sharing a per-folder prompt prefix.
+
+    Each root folder gets a prefix with its directory tree, plus a summary
+    when that makes the prefix long enough to be cached, sent first in every
+    request so the provider prompt cache applies to sibling chunks. The
+    prompt and cached tokens of each grouped request are logged. Several chunks are sent per request. Folders that fit in
+    a single request skip the prefix, since its summary would cost an extra
+    request, and are sent chunk by chunk to the contextual agent.
+
+    :param data: The chunked data, keyed by root folder.
+    :return: The contexts keyed by root folder, in the same order as the
+             chunks.
+    """
+    json_to_save: dict[str, list[str]] = defaultdict(list)
+    tokens_used: int = 0
+
+    for key, values in data.items():
+        print('Grouped process started for', key)
+
+        if len(values) <= settings.CONTEXT_CHUNKS_PER_REQUEST:
+            tokens = sum(num_tokens_from_string(value) for value in values)
+            if (tokens + tokens_used) > settings.MAX_TOKENS_PER_MINUITE:
+                tokens_used = 0
+                print('Waiting 60 seconds due to TPM limit...')
+                time.sleep(60)
+
+            responses = await asyncio.gather(
+                *[get_contextual_agent().run(value, deps=key) for value in values]
+            )
+            tokens_used += tokens
+            json_to_save[key] = [response.data for response in responses]
+            continue
+
+        prefix, summary_tokens = await build_folder_prefix(key, values)
+        prefix_tokens = num_tokens_from_string(prefix.render())
+        tokens_used += summary_tokens
+        groups = group_chunks(values, settings.CONTEXT_CHUNKS_PER_REQUEST)
+
+        # The first request goes alone to warm the prompt cache, the
+        # remaining ones are sent concurrently within the TPM limit.
+        waves: list[list[list[tuple[int, str]]]] = []
+        wave_tokens: list[int] = []
+        for n, group in enumerate(groups):
+            tokens = prefix_tokens + sum(
+                num_tokens_from_string(value) for _, value in group
+            )
+            if (
+                n > 1
+                and wave_tokens[-1] + tokens <= settings.MAX_TOKENS_PER_MINUITE
+            ):
+                waves[-1].append(group)
+                wave_tokens[-1] += tokens
+            else:
+                waves.append([group])
+                wave_tokens.append(tokens)
+
+        contexts: list[str] = []
+        for wave, tokens in zip(waves, wave_tokens):
+            if (tokens + tokens_used) > settings.MAX_TOKENS_PER_MINUITE:
+                tokens_used = 0
+                print('Waiting 60 seconds due to TPM limit...')
+                time.sleep(60)
+
+            responses = await asyncio.gather(
+                *[fetch_group(prefix, group) for group in wave]
+            )
+            tokens_used += tokens
+            contexts.extend(context for response in responses for context in response)
+
+        json_to_save[key] = contexts
+
+    return json_to_save
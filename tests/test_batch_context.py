@@ -0,0 +1,164 @@
+import asyncio
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from src.preprocessing import batch_context
+from src.preprocessing.batch_context import (
+    LocalBatchRunner,
+    OpenAIBatchRunner,
+    errors_file,
+    generate_context_in_batches,
+)
+
+DATA = {
+    'docs': ['docs/a.md\nalpha', 'docs/b.md\nbeta', 'docs/c.md\ngamma'],
+    'src': ['src/d.py\ndelta', 'src/e.py\nepsilon'],
+}
+
+
+def make_agent(requested: list[str]) -> Agent[str, str]:
+    """Offline agent answering each chunk with its last line."""
+
+    def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        chunk = messages[-1].parts[-1].content
+        requested.append(chunk)
+        return ModelResponse(parts=[TextPart(f'ctx {chunk.splitlines()[-1]}')])
+
+    return Agent(FunctionModel(respond), deps_type=str, result_type=str)
+
+
+def expected_contexts(data: dict[str, list[str]]) -> dict[str, list[str]]:
+    return {
+        key: [f'ctx {chunk.splitlines()[-1]}' for chunk in chunks]
+        for key, chunks in data.items()
+    }
+
+
+def run(data: dict[str, list[str]], batch_dir: Path, requested: list[str]):
+    runner = LocalBatchRunner(agent=make_agent(requested))
+    return asyncio.run(generate_context_in_batches(data, batch_dir, runner))
+
+
+def test_resume_requests_only_missing_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_context.settings, 'BATCH_MAX_REQUESTS_PER_FILE', 2)
+
+    first: list[str] = []
+    assert run(DATA, tmp_path, first) == expected_contexts(DATA)
+    assert len(first) == 5
+
+    # Simulate an interrupted run: keep the first line of the results file
+    # and cut the second one in the middle.
+    results_file = tmp_path / 'results_0000.jsonl'
+    lines = results_file.read_text(encoding='utf-8').splitlines(keepends=True)
+    results_file.write_text(lines[0] + lines[1][:20], encoding='utf-8')
+
+    second: list[str] = []
+    assert run(DATA, tmp_path, second) == expected_contexts(DATA)
+    assert second == [DATA['docs'][1]]
+
+
+def test_results_for_changed_chunks_are_discarded(tmp_path):
+    first: list[str] = []
+    assert run(DATA, tmp_path, first) == expected_contexts(DATA)
+
+    changed = {**DATA, 'src': ['src/d.py\ndelta', 'src/e.py\nzeta']}
+
+    second: list[str] = []
+    assert run(changed, tmp_path, second) == expected_contexts(changed)
+    assert second == [changed['src'][1]]
+
+
+class FailingRunner:
+    """Runner whose batches end without results, optionally with errors."""
+
+    def __init__(self, status_code: int | None = None) -> None:
+        self.status_code = status_code
+        self.submitted: list[str] = []
+
+    async def submit(self, requests_path: Path, results_path: Path) -> str:
+        with open(requests_path, 'r', encoding='utf-8') as file:
+            requests = [json.loads(line) for line in file]
+        self.submitted.extend(request['custom_id'] for request in requests)
+
+        if self.status_code is not None:
+            with open(errors_file(results_path), 'w', encoding='utf-8') as out:
+                for request in requests:
+                    line = {
+                        'custom_id': request['custom_id'],
+                        'response': {
+                            'status_code': self.status_code,
+                            'body': {'error': {'message': 'invalid model'}},
+                        },
+                        'error': None,
+                    }
+                    out.write(json.dumps(line) + '\n')
+
+        return f'failing-{requests_path.stem}'
+
+    async def poll(self, batch_id: str, results_path: Path) -> str:
+        return 'failed'
+
+
+def test_non_retryable_errors_are_not_resubmitted(tmp_path):
+    runner = FailingRunner(status_code=400)
+
+    for _ in range(3):
+        assert asyncio.run(generate_context_in_batches(DATA, tmp_path, runner)) is None
+
+    assert len(runner.submitted) == 5
+
+
+def test_resubmission_is_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_context.settings, 'BATCH_MAX_ATTEMPTS', 2)
+    runner = FailingRunner()
+
+    for _ in range(4):
+        assert asyncio.run(generate_context_in_batches(DATA, tmp_path, runner)) is None
+
+    assert len(runner.submitted) == 10
+
+
+class FakeFiles:
+    def __init__(self, contents: dict[str, bytes]) -> None:
+        self.contents = contents
+
+    async def content(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(read=lambda: self.contents[file_id])
+
+
+class FakeBatches:
+    def __init__(self, batch: SimpleNamespace) -> None:
+        self.batch = batch
+
+    async def retrieve(self, batch_id: str) -> SimpleNamespace:
+        return self.batch
+
+
+def test_openai_poll_reports_batch_errors(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    error_line = b'{"custom_id": "docs::0::abc", "response": {"status_code": 400}}\n'
+    batch = SimpleNamespace(
+        status='failed',
+        output_file_id=None,
+        error_file_id='file-errors',
+        errors=SimpleNamespace(
+            data=[SimpleNamespace(code='invalid_model', line=1, message='bad model')]
+        ),
+    )
+    runner = OpenAIBatchRunner()
+    runner.client = SimpleNamespace(
+        batches=FakeBatches(batch),
+        files=FakeFiles({'file-errors': error_line}),
+    )
+
+    results_path = tmp_path / 'results_0000.jsonl'
+    assert asyncio.run(runner.poll('batch-1', results_path)) == 'failed'
+
+    assert not results_path.exists()
+    assert errors_file(results_path).read_bytes() == error_line
+    assert 'invalid_model (line 1): bad model' in capsys.readouterr().out
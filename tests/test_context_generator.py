@@ -0,0 +1,96 @@
+import asyncio
+
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from src.agents.contextual_agent import (
+    get_contextual_agent,
+    get_folder_summary_agent,
+    get_grouped_contextual_agent,
+)
+from src.preprocessing import context_generator
+from src.preprocessing.context_generator import generate_grouped_context
+
+
+def recording_model(requests: list[str], respond) -> FunctionModel:
+    def function(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        prompt = messages[-1].parts[-1].content
+        requests.append(prompt)
+        return respond(prompt, info)
+
+    return FunctionModel(function)
+
+
+def text(prompt: str, info: AgentInfo) -> ModelResponse:
+    return ModelResponse(parts=[TextPart(f'ctx {prompt.splitlines()[-1]}')])
+
+
+def chunk_contexts(prompt: str, info: AgentInfo) -> ModelResponse:
+    # Answers every chunk but the last one, which must fall back to the
+    # single-chunk agent.
+    indexes = [
+        int(line.removeprefix('### Chunk '))
+        for line in prompt.splitlines()
+        if line.startswith('### Chunk ')
+    ]
+    contexts = [{'index': i, 'context': f'grouped {i}'} for i in indexes[:-1]]
+    return ModelResponse(
+        parts=[
+            ToolCallPart(
+                tool_name=info.result_tools[0].name,
+                args={'response': contexts},
+            )
+        ]
+    )
+
+
+def run_grouped(monkeypatch, min_cache_tokens: int):
+    # The agents are built on first use and their provider needs a key,
+    # no request reaches it since every model is overridden.
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(context_generator, 'num_tokens_from_string', len)
+    monkeypatch.setattr(
+        context_generator.settings, 'CONTEXT_CHUNKS_PER_REQUEST', 2
+    )
+    monkeypatch.setattr(
+        context_generator.settings, 'PROMPT_CACHE_MIN_TOKENS', min_cache_tokens
+    )
+    data = {
+        'docs': ['docs/a.md\nalpha'],
+        'src': [f'src/m{n}.py\nbody {n}' for n in range(4)],
+    }
+
+    single: list[str] = []
+    summaries: list[str] = []
+    grouped: list[str] = []
+    with (
+        get_contextual_agent().override(model=recording_model(single, text)),
+        get_folder_summary_agent().override(
+            model=recording_model(summaries, text)
+        ),
+        get_grouped_contextual_agent().override(
+            model=recording_model(grouped, chunk_contexts)
+        ),
+    ):
+        result = asyncio.run(generate_grouped_context(data))
+
+    assert result == {
+        'docs': ['ctx alpha'],
+        'src': ['grouped 0', 'ctx body 1', 'grouped 2', 'ctx body 3'],
+    }
+    assert len(grouped) == 2
+    assert single == [data['docs'][0], data['src'][1], data['src'][3]]
+    return summaries
+
+
+def test_grouped_context_summarizes_cacheable_prefixes(monkeypatch):
+    summaries = run_grouped(monkeypatch, min_cache_tokens=0)
+
+    # Only the folder spanning several requests pays for a summary.
+    assert summaries == ['src\n  m0.py\n  m1.py\n  m2.py\n  m3.py']
+
+
+def test_grouped_context_skips_summary_below_cache_threshold(monkeypatch):
+    summaries = run_grouped(monkeypatch, min_cache_tokens=10**6)
+
+    assert summaries == []
@@ -0,0 +1,159 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import asyncpg
+import pytest
+
+from src.core import database
+from src.core.database import (
+    check_partitioned,
+    partition_name,
+    shadow_name,
+    swap_shadow,
+    validate_shadow,
+)
+
+
+class FakeConnection:
+    def __init__(self, partitioned: bool) -> None:
+        self.partitioned = partitioned
+
+    async def fetchval(self, query: str) -> bool:
+        assert 'pg_partitioned_table' in query
+        return self.partitioned
+
+
+def test_check_partitioned_accepts_partitioned_repo():
+    asyncio.run(check_partitioned(FakeConnection(partitioned=True)))
+
+
+def test_check_partitioned_rejects_legacy_repo():
+    with pytest.raises(RuntimeError, match='DROP TABLE repo'):
+        asyncio.run(check_partitioned(FakeConnection(partitioned=False)))
+
+
+def test_partition_name():
+    assert partition_name('pandas_ta') == 'repo_pandas_ta'
+    assert shadow_name('pandas_ta') == 'repo_pandas_ta_next'
+
+
+@pytest.mark.parametrize(
+    'collection', ['Pandas', '1lib', 'lib-ta', 'lib\n', 'lib; drop', '']
+)
+def test_partition_name_rejects_invalid_identifiers(collection):
+    with pytest.raises(ValueError, match='Invalid collection name'):
+        partition_name(collection)
+
+
+@pytest.mark.parametrize('collection', ['foo_next', 'foo_old'])
+def test_partition_name_rejects_generation_suffixes(collection):
+    # repo_foo_next and repo_foo_old are the shadow and previous generation
+    # of collection foo, a rebuild of foo would drop them.
+    with pytest.raises(ValueError, match='reserved'):
+        partition_name(collection)
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeLockingConnection:
+    """Connection whose DETACH times out on the lock a number of times."""
+
+    def __init__(self, lock_failures: int) -> None:
+        self.lock_failures = lock_failures
+        self.statements: list[str] = []
+
+    def transaction(self) -> FakeTransaction:
+        return FakeTransaction()
+
+    async def execute(self, query: str) -> None:
+        self.statements.append(query)
+        if 'DETACH' in query and self.lock_failures:
+            self.lock_failures -= 1
+            raise asyncpg.exceptions.LockNotAvailableError('lock timeout')
+
+    async def fetchval(self, query: str, *args) -> str:
+        return 'repo_pandas_ta'
+
+
+class FakePool:
+    def __init__(self, conn: FakeLockingConnection) -> None:
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+    async def execute(self, query: str) -> None:
+        self.conn.statements.append(query)
+
+    async def fetchval(self, query: str, *args):
+        return await self.conn.fetchval(query, *args)
+
+    async def fetch(self, query: str, *args) -> list[dict]:
+        return await self.conn.fetch(query, *args)
+
+
+def patch_pool(monkeypatch, conn: FakeLockingConnection) -> None:
+    @asynccontextmanager
+    async def connect():
+        yield FakePool(conn)
+
+    async def no_sleep(seconds: float) -> None:
+        pass
+
+    monkeypatch.setattr(database, 'database_connect', connect)
+    monkeypatch.setattr(database.asyncio, 'sleep', no_sleep)
+
+
+def test_swap_shadow_retries_on_lock_timeout(monkeypatch):
+    conn = FakeLockingConnection(lock_failures=1)
+    patch_pool(monkeypatch, conn)
+
+    asyncio.run(swap_shadow('pandas_ta'))
+
+    assert sum('lock_timeout' in query for query in conn.statements) == 2
+    assert any('ATTACH PARTITION repo_pandas_ta' in q for q in conn.statements)
+    assert conn.statements[-1] == 'DROP TABLE IF EXISTS repo_pandas_ta_old'
+
+
+def test_swap_shadow_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(database.settings, 'SWAP_MAX_ATTEMPTS', 3)
+    conn = FakeLockingConnection(lock_failures=10)
+    patch_pool(monkeypatch, conn)
+
+    with pytest.raises(RuntimeError, match='live collection is untouched'):
+        asyncio.run(swap_shadow('pandas_ta'))
+
+    assert not any('ATTACH' in query for query in conn.statements)
+
+
+class FakeValidationConnection(FakeLockingConnection):
+    def __init__(self) -> None:
+        super().__init__(lock_failures=0)
+
+    async def fetchval(self, query: str, *args):
+        self.statements.append(query)
+        return 3 if 'count(*)' in query else 0.0
+
+    async def fetch(self, query: str, *args) -> list[dict]:
+        return [{'id': 1, 'embedding': '[1,0]'}, {'id': 2, 'embedding': '[0,1]'}]
+
+
+def test_validate_shadow_forces_the_index(monkeypatch):
+    conn = FakeValidationConnection()
+    patch_pool(monkeypatch, conn)
+
+    asyncio.run(validate_shadow('pandas_ta', expected_rows=3))
+
+    seqscan = conn.statements.index('SET LOCAL enable_seqscan = off')
+    sample_queries = [
+        n for n, query in enumerate(conn.statements) if '<=>' in query
+    ]
+    assert len(sample_queries) == 2
+    assert all(n > seqscan for n in sample_queries)
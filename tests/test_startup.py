@@ -0,0 +1,82 @@
+"""
+Startup regressions: the CLI entry points must not pay for heavy imports
+that the requested stage does not need.
+"""
+
+import json
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ['gitingest', 'tiktoken', 'pydantic_ai', 'openai', 'asyncpg']
+
+# Generous bound, only meant to catch an eager heavy import creeping back.
+MAX_STARTUP_SECONDS = 5.0
+
+
+def run_python(code: str) -> list[str]:
+    """Runs code in a fresh interpreter and returns the modules it printed."""
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def loaded_modules_snippet(modules: list[str]) -> str:
+    return (
+        'import json, sys\n'
+        f'print(json.dumps([m for m in {modules!r} if m in sys.modules]))\n'
+    )
+
+
+def test_entry_point_imports_are_light():
+    start = time.perf_counter()
+    loaded = run_python(
+        'import preprocess, main, src.agents.rag_agent\n'
+        + loaded_modules_snippet(HEAVY_MODULES)
+    )
+    elapsed = time.perf_counter() - start
+
+    assert loaded == []
+    assert elapsed < MAX_STARTUP_SECONDS
+
+
+def test_only_stage_embed_skips_ingest_chunk_and_agent_imports(tmp_path):
+    collection_dir = tmp_path / 'pandas_ta'
+    collection_dir.mkdir()
+    (collection_dir / 'final_data.json').write_text(
+        json.dumps({'docs': ['context\nchunk']}), encoding='utf-8'
+    )
+
+    # The database coroutines are discarded, so the stage runs its imports
+    # without needing a database or an API key.
+    loaded = run_python(
+        textwrap.dedent(
+            f"""
+            import asyncio, sys
+
+            def run(coroutine):
+                coroutine.close()
+
+            asyncio.run = run
+            sys.argv = [
+                'preprocess.py', '--only-stage', 'embed',
+                '--data-dir', {str(tmp_path)!r},
+            ]
+
+            import preprocess
+            preprocess.main()
+            """
+        )
+        + loaded_modules_snippet(['gitingest', 'tiktoken', 'pydantic_ai'])
+    )
+
+    assert loaded == []